@@ -364,12 +364,13 @@ def main():
     print("=" * 50)
     
     # --- 配置 ---
-    # 请在这里填入你的OpenRouter API Key
+    # 通过 OPENROUTER_API_KEY 环境变量提供OpenRouter API Key
     # 你可以从这里获取: https://openrouter.ai/keys
-    API_KEY = os.environ.get("OPENROUTER_API_KEY", "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") # 优先从环境变量读取
+    API_KEY = os.environ.get("OPENROUTER_API_KEY")
     
-    if "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" in API_KEY:
-        logger.warning("🔑 警告: 正在使用默认的API Key。建议设置 OPENROUTER_API_KEY 环境变量。")
+    if not API_KEY:
+        logger.error("❌ 未设置 OPENROUTER_API_KEY 环境变量")
+        return
 
     # 文件路径
     doc_template_path = "template_test2.doc"  # 使用.doc或.docx文件
@@ -6,17 +6,36 @@
 """
 
 import os
-import json
+import re
+import hashlib
 import logging
+import shutil
+import sqlite3
 import subprocess
+import tempfile
+import functools
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
-from typing import Dict, Any, List
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple, Union
+import httpx
 from docx import Document
-from openai import OpenAI
+from docx.document import Document as DocumentObject
+from docx.opc.exceptions import PackageNotFoundError
+from docx.oxml import OxmlElement
+from docx.oxml.ns import qn
+from openai import APIError, OpenAI
 
 # 导入新的提示词工具
 from prompt_utils import PromptTemplates, PromptHelper
 
+# 优先使用orjson加速JSON解析，未安装时回退到标准库
+try:
+    import orjson as _json
+except ImportError:
+    import json as _json
+
 # 配置日志
 logging.basicConfig(
     level=logging.INFO,
@@ -25,18 +44,336 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# 可能的LibreOffice路径
+_LIBREOFFICE_PATHS = [
+    '/Applications/LibreOffice.app/Contents/MacOS/soffice',  # macOS
+    'libreoffice',  # Linux/Windows PATH
+    'soffice',  # 备用命令
+]
+
+# 进程内缓存已找到的LibreOffice命令，避免每次转换都重新探测
+_LIBREOFFICE_CMD: Optional[str] = None
+
+
+def _resolve_libreoffice() -> Optional[str]:
+    """
+    查找可用的LibreOffice命令，结果在进程内缓存
+
+    Returns:
+        LibreOffice命令路径，未找到时返回None
+    """
+    global _LIBREOFFICE_CMD
+    if _LIBREOFFICE_CMD:
+        return _LIBREOFFICE_CMD
+
+    for path in _LIBREOFFICE_PATHS:
+        # 先用which过滤不存在的候选，只对找到的命令启动子进程确认
+        resolved = shutil.which(path)
+        if not resolved:
+            continue
+        try:
+            # 只需要返回码，丢弃输出避免管道读取和解码
+            result = subprocess.run([resolved, '--version'], 
+                                  stdout=subprocess.DEVNULL, 
+                                  stderr=subprocess.DEVNULL, 
+                                  timeout=10)
+            if result.returncode == 0:
+                _LIBREOFFICE_CMD = resolved
+                logger.info(f"✅ 找到LibreOffice: {resolved}")
+                break
+        except (FileNotFoundError, subprocess.TimeoutExpired):
+            continue
+
+    return _LIBREOFFICE_CMD
+
+
+# 位置键格式：row_{行}_col_{列}_{字段} 或 row_{行}_left_{上下文}_{字段}
+_POS_RE = re.compile(r'^row_(\d+)_(?:col_(\d+)|left_([^_]+))_(.+)$')
+
+
+@functools.lru_cache(maxsize=4096)
+def _parse_position_key_cached(position_key: str) -> Optional[Dict[str, Any]]:
+    """解析位置键（结果缓存，调用方不得修改返回的字典）"""
+    m = _POS_RE.match(position_key)
+    if not m:
+        return None
+    
+    row, col, context, field_name = m.groups()
+    if col is not None:
+        return {
+            'row': int(row) - 1,  # 转换为0索引
+            'col': int(col) - 1,  # 转换为0索引
+            'field_name': field_name,
+            'fill_type': 'next_cell'
+        }
+    return {
+        'row': int(row) - 1,
+        'col': -1,  # 表示需要根据上下文查找
+        'context': context,
+        'field_name': field_name,
+        'fill_type': 'same_cell_with_context'
+    }
+
+
+# 字段分类：分组序号对应 _FIELD_TYPES 中的类别
+_FIELD_CLASSIFIER = re.compile(r'(编号|项目名称|复核日期)|(现场复核情况)|(负责人|复核人员)')
+_FIELD_TYPES = (None, 'basic_info', 'review_situation', 'personnel')
+
+
+class EmptyAIResponseError(RuntimeError):
+    """AI回复为空（没有choices或内容为空），由各阶段按可恢复错误处理"""
+
+
+# 本地缓存目录
+_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'ai_docgen')
+_LLM_CACHE_PATH = os.path.join(_CACHE_DIR, 'llm_cache.sqlite3')
+_CONVERTED_CACHE_DIR = os.path.join(_CACHE_DIR, 'converted')
+
+
+def _llm_cache_key(model: str, prompt: str) -> str:
+    """根据模型和提示词生成缓存键"""
+    return hashlib.blake2b(f"{model}\x00{prompt}".encode('utf-8')).hexdigest()
+
+
+def _llm_cache_connect() -> sqlite3.Connection:
+    """打开LLM缓存数据库（不存在时创建）"""
+    os.makedirs(_CACHE_DIR, exist_ok=True)
+    conn = sqlite3.connect(_LLM_CACHE_PATH, timeout=30)
+    conn.execute("CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, content TEXT NOT NULL)")
+    return conn
+
+
+def _llm_cache_get(key: str) -> Optional[str]:
+    """读取缓存的AI回复，未命中或缓存不可用时返回None"""
+    try:
+        conn = _llm_cache_connect()
+        try:
+            row = conn.execute("SELECT content FROM llm_cache WHERE key = ?", (key,)).fetchone()
+        finally:
+            conn.close()
+    except (OSError, sqlite3.Error) as e:
+        logger.warning(f"⚠️ 读取LLM缓存失败: {e}")
+        return None
+    return row[0] if row else None
+
+
+def _llm_cache_set(key: str, content: str):
+    """写入AI回复到缓存，失败时只记录警告"""
+    try:
+        conn = _llm_cache_connect()
+        try:
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO llm_cache (key, content) VALUES (?, ?)", (key, content))
+        finally:
+            conn.close()
+    except (OSError, sqlite3.Error) as e:
+        logger.warning(f"⚠️ 写入LLM缓存失败: {e}")
+
+
+def _preview(value: Any, limit: int = 50) -> str:
+    """截断过长的值用于日志预览"""
+    text = str(value)
+    return text[:limit] + "..." if len(text) > limit else text
+
+
+def _file_digest(file_path: str) -> str:
+    """计算文件内容的blake2b摘要"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _link_or_copy(src: str, dst: str):
+    """用硬链接把文件放到目标位置，跨文件系统时退回到复制"""
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def _convert_doc_to_docx(doc_path: str, profile_root: Optional[str] = None) -> str:
+    """
+    使用LibreOffice将.doc文件转换为.docx文件
+    
+    Args:
+        doc_path: .doc文件路径
+        profile_root: 并行转换时的LibreOffice用户配置根目录，每个进程在其中使用独立且复用的配置
+        
+    Returns:
+        转换后的.docx文件路径
+    """
+    logger.info("🔄 开始DOC到DOCX转换...")
+    
+    if not os.path.exists(doc_path):
+        logger.error(f"❌ DOC文件不存在: {doc_path}")
+        raise FileNotFoundError(f"DOC文件不存在: {doc_path}")
+    
+    # 生成输出文件名
+    docx_path = doc_path.replace('.doc', '_converted.docx')
+    
+    # 已转换的文件比源文件新时直接复用
+    if os.path.exists(docx_path) and os.path.getmtime(docx_path) >= os.path.getmtime(doc_path):
+        logger.info(f"♻️ 复用已转换的文件: {docx_path}")
+        return docx_path
+    
+    # 相同内容的DOC已转换过时直接取缓存结果
+    cached_docx = os.path.join(_CONVERTED_CACHE_DIR, f"{_file_digest(doc_path)}.docx")
+    if os.path.exists(cached_docx):
+        _link_or_copy(cached_docx, docx_path)
+        # 刷新修改时间，之后的运行可直接走mtime检查，无需再次计算哈希
+        os.utime(docx_path)
+        logger.info(f"♻️ 命中转换缓存: {cached_docx}")
+        return docx_path
+    
+    try:
+        # 检查LibreOffice是否可用
+        logger.info("🔍 检查LibreOffice可用性...")
+        
+        libreoffice_cmd = _resolve_libreoffice()
+        if not libreoffice_cmd:
+            logger.error("❌ 未找到LibreOffice，请确保已安装LibreOffice")
+            raise RuntimeError("LibreOffice未安装或不可用")
+        
+        # 执行转换
+        logger.info(f"📄 正在转换: {doc_path} -> {docx_path}")
+        
+        # 删除已存在的输出文件
+        if os.path.exists(docx_path):
+            os.remove(docx_path)
+            logger.info("🗑️ 删除已存在的转换文件")
+        
+        # LibreOffice转换命令
+        cmd = [
+            libreoffice_cmd,
+            '--headless',
+            '--convert-to', 'docx',
+            '--outdir', os.path.dirname(doc_path),
+            doc_path
+        ]
+        if profile_root:
+            # 并发运行的LibreOffice不能共用同一个用户配置目录；
+            # 按进程号区分，同一工作进程的后续转换复用已初始化的配置
+            profile_dir = Path(profile_root, f"lo_{os.getpid()}")
+            cmd.insert(1, f"-env:UserInstallation={profile_dir.as_uri()}")
+        
+        logger.info(f"🔧 执行命令: {' '.join(cmd)}")
+        
+        result = subprocess.run(cmd, 
+                              capture_output=True, 
+                              text=True, 
+                              timeout=30)
+        
+        if result.returncode != 0:
+            logger.error(f"❌ LibreOffice转换失败: {result.stderr}")
+            raise RuntimeError(f"LibreOffice转换失败: {result.stderr}")
+        
+        # 检查转换后的文件
+        expected_docx = doc_path.replace('.doc', '.docx')
+        if os.path.exists(expected_docx):
+            # 重命名为我们期望的文件名
+            if expected_docx != docx_path:
+                os.rename(expected_docx, docx_path)
+            
+            logger.info(f"✅ 转换成功: {docx_path}")
+            
+            # 按内容哈希保存转换结果，缓存失败不影响本次转换
+            try:
+                os.makedirs(_CONVERTED_CACHE_DIR, exist_ok=True)
+                _link_or_copy(docx_path, cached_docx)
+            except OSError as e:
+                logger.warning(f"⚠️ 保存转换缓存失败: {e}")
+            return docx_path
+        else:
+            logger.error(f"❌ 转换后的文件未找到: {expected_docx}")
+            raise RuntimeError("转换后的文件未找到")
+            
+    except subprocess.TimeoutExpired:
+        logger.error("❌ LibreOffice转换超时")
+        raise RuntimeError("LibreOffice转换超时")
+    except Exception as e:
+        logger.error(f"❌ 转换过程中出错: {e}")
+        raise
+
+
+def _open_template(template: Union[str, DocumentObject]) -> DocumentObject:
+    """模板可以是文件路径或已打开的Document对象，路径时才解析文件"""
+    if isinstance(template, (str, os.PathLike)):
+        return Document(template)
+    return template
+
+
+def _append_cell_paragraph(cell, text: str):
+    """在单元格末尾直接追加一个段落元素，不创建段落和run包装对象"""
+    run = OxmlElement('w:r')
+    run.text = text  # 换行和制表符转换方式与Run.text相同
+    paragraph = OxmlElement('w:p')
+    paragraph.append(run)
+    cell._tc.append(paragraph)
+
+
+def _set_cell_text(cell, text: str):
+    """设置单元格文本，沿用首个run的格式；单元格没有run时退回到cell.text"""
+    tc = cell._tc
+    paragraphs = tc.p_lst
+    runs = paragraphs[0].r_lst if paragraphs else []
+    if not runs:
+        cell.text = text
+        return
+    
+    first_paragraph, first_run = paragraphs[0], runs[0]
+    first_run.text = text  # 只清空run内容，保留rPr格式
+    
+    # 与cell.text一致：单元格只保留tcPr和首段，首段只保留pPr和首个run
+    # （超链接、修订、域、内容控件等中的run也一并移除）
+    for child in list(tc):
+        if child is not first_paragraph and child.tag != qn('w:tcPr'):
+            tc.remove(child)
+    for child in list(first_paragraph):
+        if child is not first_run and child.tag != qn('w:pPr'):
+            first_paragraph.remove(child)
+
+
 class EnhancedAIDocGenerator:
     """增强版AI文档生成器 - 支持位置感知映射"""
     
+    # 降级映射的基础规则：语义字段 -> 可能的字段名
+    _FALLBACK_MAPPING_RULES = {
+        "serial_number": ["编号", "number", "id"],
+        "project_name": ["项目名称", "name", "title"],  
+        "review_date": ["复核日期", "date", "check_date"],
+        "original_condition_review": ["原形制", "original_state", "original_form"],
+        "damage_assessment_review": ["病害和残损", "damage", "deterioration"],
+        "repair_plan_review": ["修缮做法", "repair_method", "repair_plan"],
+        "project_lead": ["项目负责人", "project_manager", "manager", "lead"],
+        "reviewer": ["复核人员", "reviewers", "checker"]
+    }
+    
     def __init__(self, api_key: str):
         """初始化OpenRouter客户端"""
+        # 所有AI调用复用同一个HTTP/2长连接，避免重复TLS握手
+        self.http_client = httpx.Client(
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=4, keepalive_expiry=60.0),
+            timeout=httpx.Timeout(60.0, read=600.0),  # 长回复需要更长的读取超时
+        )
         self.client = OpenAI(
             base_url="https://openrouter.ai/api/v1",
             api_key=api_key,
+            http_client=self.http_client,
         )
         self.model = "google/gemini-2.5-pro-preview"
         self.prompt_templates = PromptTemplates()
         self.prompt_helper = PromptHelper()
+        # 降级映射用的倒排索引：字段名 -> 语义字段
+        self._rule_inverted_index: Dict[str, str] = {
+            token: semantic_key
+            for semantic_key, tokens in self._FALLBACK_MAPPING_RULES.items()
+            for token in tokens + [semantic_key]
+        }
         logger.info("🤖 增强版AI生成器初始化完成")
     
     def convert_doc_to_docx(self, doc_path: str) -> str:
@@ -49,174 +386,176 @@ class EnhancedAIDocGenerator:
         Returns:
             转换后的.docx文件路径
         """
-        logger.info("🔄 开始DOC到DOCX转换...")
+        return _convert_doc_to_docx(doc_path)
+    
+    @classmethod
+    def convert_many(cls, doc_paths: List[str]) -> List[Optional[str]]:
+        """
+        使用多进程并行转换多个.doc文件
         
-        if not os.path.exists(doc_path):
-            logger.error(f"❌ DOC文件不存在: {doc_path}")
-            raise FileNotFoundError(f"DOC文件不存在: {doc_path}")
+        Args:
+            doc_paths: .doc文件路径列表
+            
+        Returns:
+            与输入顺序对应的.docx文件路径列表，转换失败的位置为None
+        """
+        unique_paths = list(dict.fromkeys(doc_paths))
+        converted: Dict[str, Optional[str]] = {}
         
-        # 生成输出文件名
-        docx_path = doc_path.replace('.doc', '_converted.docx')
+        max_workers = min(len(unique_paths), os.cpu_count() or 1) or 1
+        logger.info(f"🔄 并行转换 {len(unique_paths)} 个DOC文件 (进程数: {max_workers})")
         
+        # 各工作进程的LibreOffice配置放在同一临时目录下，进程池关闭后统一删除
+        profile_root = tempfile.mkdtemp(prefix="lo_profiles_")
         try:
-            # 检查LibreOffice是否可用
-            logger.info("🔍 检查LibreOffice可用性...")
-            
-            # 尝试多个可能的LibreOffice路径
-            libreoffice_paths = [
-                '/Applications/LibreOffice.app/Contents/MacOS/soffice',  # macOS
-                'libreoffice',  # Linux/Windows PATH
-                'soffice',  # 备用命令
-            ]
-            
-            libreoffice_cmd = None
-            for path in libreoffice_paths:
-                try:
-                    result = subprocess.run([path, '--version'], 
-                                          capture_output=True, 
-                                          text=True, 
-                                          timeout=10)
-                    if result.returncode == 0:
-                        libreoffice_cmd = path
-                        logger.info(f"✅ 找到LibreOffice: {path}")
-                        break
-                except (FileNotFoundError, subprocess.TimeoutExpired):
-                    continue
-            
-            if not libreoffice_cmd:
-                logger.error("❌ 未找到LibreOffice，请确保已安装LibreOffice")
-                raise RuntimeError("LibreOffice未安装或不可用")
-            
-            # 执行转换
-            logger.info(f"📄 正在转换: {doc_path} -> {docx_path}")
-            
-            # 删除已存在的输出文件
-            if os.path.exists(docx_path):
-                os.remove(docx_path)
-                logger.info("🗑️ 删除已存在的转换文件")
-            
-            # LibreOffice转换命令
-            cmd = [
-                libreoffice_cmd,
-                '--headless',
-                '--convert-to', 'docx',
-                '--outdir', os.path.dirname(doc_path),
-                doc_path
-            ]
-            
-            logger.info(f"🔧 执行命令: {' '.join(cmd)}")
-            
-            result = subprocess.run(cmd, 
-                                  capture_output=True, 
-                                  text=True, 
-                                  timeout=30)
-            
-            if result.returncode != 0:
-                logger.error(f"❌ LibreOffice转换失败: {result.stderr}")
-                raise RuntimeError(f"LibreOffice转换失败: {result.stderr}")
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                futures = {path: executor.submit(_convert_doc_to_docx, path, profile_root) for path in unique_paths}
+                for path, future in futures.items():
+                    try:
+                        converted[path] = future.result()
+                    except Exception as e:
+                        logger.error(f"❌ 转换失败: {path} - {e}")
+                        converted[path] = None
+        finally:
+            shutil.rmtree(profile_root, ignore_errors=True)
+        
+        return [converted[path] for path in doc_paths]
+    
+    def _chat_completion(self, prompt: str) -> Tuple[str, bool]:
+        """
+        调用AI并返回回复文本，相同模型和提示词的结果从本地缓存读取
+        
+        回复不会自动写入缓存，调用方解析成功后再调用 _cache_chat_reply，
+        避免无效回复被永久复用。
+        
+        Args:
+            prompt: 提示词
             
-            # 检查转换后的文件
-            expected_docx = doc_path.replace('.doc', '.docx')
-            if os.path.exists(expected_docx):
-                # 重命名为我们期望的文件名
-                if expected_docx != docx_path:
-                    os.rename(expected_docx, docx_path)
-                
-                logger.info(f"✅ 转换成功: {docx_path}")
-                return docx_path
-            else:
-                logger.error(f"❌ 转换后的文件未找到: {expected_docx}")
-                raise RuntimeError("转换后的文件未找到")
-                
-        except subprocess.TimeoutExpired:
-            logger.error("❌ LibreOffice转换超时")
-            raise RuntimeError("LibreOffice转换超时")
-        except Exception as e:
-            logger.error(f"❌ 转换过程中出错: {e}")
-            raise
+        Returns:
+            (AI回复的文本内容, 是否来自缓存)
+        """
+        cache_key = _llm_cache_key(self.model, prompt)
+        cached = _llm_cache_get(cache_key)
+        if cached is not None:
+            logger.info("⚡ 命中LLM缓存，跳过AI调用")
+            return cached, True
+        
+        response = self.client.chat.completions.create(
+            model=self.model,
+            messages=[{"role": "user", "content": prompt}],
+            extra_headers={
+                "HTTP-Referer": "ai-doc-generator",
+                "X-Title": "AI Document Generator Enhanced",
+            }
+        )
+        
+        # 拒答、空回复或HTTP 200的错误负载都可能没有可用内容
+        content = response.choices[0].message.content if response.choices else None
+        if not content:
+            raise EmptyAIResponseError("AI返回了空回复")
+        return content, False
     
-    def stage1_analyze_template_with_position(self, template_path: str) -> Dict[str, str]:
+    def _cache_chat_reply(self, prompt: str, content: str):
+        """将已验证可解析的AI回复写入缓存"""
+        _llm_cache_set(_llm_cache_key(self.model, prompt), content)
+    
+    def stage1_analyze_template_with_position(self, template: Union[str, DocumentObject]) -> Dict[str, str]:
         """
         阶段1：增强版模板分析 - 提取位置信息和上下文
+        
+        Args:
+            template: 模板文件路径或已打开的Document对象
         """
         logger.info("🔍 阶段1：开始位置感知的模板结构分析...")
         
         try:
-            # 读取Word文档内容
-            doc = Document(template_path)
-            template_content = ""
-            
-            logger.info(f"📄 正在读取模板文件: {template_path}")
-            
-            # 增强版模板内容提取 - 包含更多上下文信息
-            table_count = 0
-            for table in doc.tables:
-                table_count += 1
-                logger.info(f"📋 处理第 {table_count} 个表格")
-                template_content += f"\n=== 表格 {table_count} ===\n"
-                
-                for row_idx, row in enumerate(table.rows):
-                    row_content = ""
-                    for cell_idx, cell in enumerate(row.cells):
-                        cell_text = cell.text.strip()
-                        if cell_text:
-                            row_content += f"[Row{row_idx+1}Col{cell_idx+1}]: {cell_text} | "
-                    
-                    if row_content:
-                        template_content += f"第{row_idx+1}行: {row_content}\n"
-                        
-                        # 添加上下文分析
-                        if row_idx > 0:
-                            prev_row_content = ""
-                            for cell_idx, cell in enumerate(table.rows[row_idx-1].cells):
-                                prev_cell_text = cell.text.strip()
-                                if prev_cell_text:
-                                    prev_row_content += f"{prev_cell_text} | "
-                            if prev_row_content:
-                                template_content += f"  上方行内容: {prev_row_content}\n"
-            
-            logger.info(f"📊 增强版模板内容提取完成，共 {table_count} 个表格")
-            
-            # 使用增强版提示词分析模板结构
-            prompt = self.prompt_templates.get_template_analysis_prompt(template_content)
-            
-            logger.info("🧠 正在调用AI进行位置感知的模板字段分析...")
-            
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[{"role": "user", "content": prompt}],
-                extra_headers={
-                    "HTTP-Referer": "ai-doc-generator",
-                    "X-Title": "AI Document Generator Enhanced",
-                }
-            )
-            
-            # 解析返回的JSON
-            json_text = self.prompt_helper.extract_json_from_response(response.choices[0].message.content)
-            
-            # 验证JSON有效性
-            if not self.prompt_helper.validate_json_structure(json_text):
-                logger.warning("⚠️ AI返回的JSON格式无效，使用降级结构")
-                template_structure = self.prompt_helper.create_fallback_structure(template_content)
-            else:
-                template_structure = json.loads(json_text)
-            
-            logger.info(f"✅ 成功提取 {len(template_structure)} 个位置感知字段:")
-            for key, value in template_structure.items():
-                logger.info(f"   📌 {key}: {value}")
-            
-            # 记录字段统计信息
-            self._log_field_statistics(template_structure)
-            
-            return template_structure
-            
-        except Exception as e:
+            return self._stage1_impl(template)
+        except (_json.JSONDecodeError, APIError, EmptyAIResponseError, OSError, KeyError, PackageNotFoundError) as e:
             logger.error(f"❌ 阶段1错误: {e}")
             # 返回降级结构
             fallback_structure = self.prompt_helper.create_fallback_structure("")
             logger.warning("⚠️ 使用降级模板结构")
             return fallback_structure
     
+    def _stage1_impl(self, template: Union[str, DocumentObject]) -> Dict[str, str]:
+        """阶段1的具体实现，可恢复的错误由调用方处理"""
+        # 读取Word文档内容
+        if isinstance(template, (str, os.PathLike)):
+            logger.info(f"📄 正在读取模板文件: {template}")
+        doc = _open_template(template)
+        
+        # 增强版模板内容提取 - 包含更多上下文信息
+        table_contents = []
+        table_count = 0
+        for table in doc.tables:
+            table_count += 1
+            logger.info(f"📋 处理第 {table_count} 个表格")
+            table_contents.append(self._extract_table_text(table, table_count))
+        template_content = ''.join(table_contents)
+        
+        logger.info(f"📊 增强版模板内容提取完成，共 {table_count} 个表格")
+        
+        # 使用增强版提示词分析模板结构
+        prompt = self.prompt_templates.get_template_analysis_prompt(template_content)
+        
+        logger.info("🧠 正在调用AI进行位置感知的模板字段分析...")
+        
+        response_text, from_cache = self._chat_completion(prompt)
+        
+        # 解析返回的JSON
+        json_text = self.prompt_helper.extract_json_from_response(response_text)
+        
+        # 验证JSON有效性，顶层必须是对象
+        parsed = _json.loads(json_text) if self.prompt_helper.validate_json_structure(json_text) else None
+        if not isinstance(parsed, dict):
+            logger.warning("⚠️ AI返回的JSON格式无效，使用降级结构")
+            template_structure = self.prompt_helper.create_fallback_structure(template_content)
+        else:
+            template_structure = parsed
+            if not from_cache:
+                self._cache_chat_reply(prompt, response_text)
+        
+        logger.info(f"✅ 成功提取 {len(template_structure)} 个位置感知字段")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("📌 位置感知字段:%s", ''.join(f"\n   📌 {key}: {value}" for key, value in template_structure.items()))
+        
+        # 记录字段统计信息
+        self._log_field_statistics(template_structure)
+        
+        return template_structure
+    
+    def _extract_table_text(self, table, table_number: int) -> str:
+        """
+        提取单个表格的文本内容及上方行上下文
+        
+        Args:
+            table: 表格对象
+            table_number: 表格序号（从1开始）
+            
+        Returns:
+            用于模板分析提示词的表格文本
+        """
+        # 每个单元格只读取一次文本
+        rows: List[List[str]] = [[cell.text.strip() for cell in row.cells] for row in table.rows]
+        
+        parts = [f"\n=== 表格 {table_number} ===\n"]
+        for row_idx, cell_texts in enumerate(rows):
+            row_content = ''.join(
+                f"[Row{row_idx+1}Col{cell_idx+1}]: {cell_text} | "
+                for cell_idx, cell_text in enumerate(cell_texts) if cell_text
+            )
+            if not row_content:
+                continue
+            parts.append(f"第{row_idx+1}行: {row_content}\n")
+            
+            # 添加上下文分析
+            if row_idx > 0:
+                prev_row_content = ''.join(f"{cell_text} | " for cell_text in rows[row_idx-1] if cell_text)
+                if prev_row_content:
+                    parts.append(f"  上方行内容: {prev_row_content}\n")
+        
+        return ''.join(parts)
+    
     def stage2_load_json_data(self, json_file_path: str) -> Dict[str, str]:
         """
         阶段2：从JSON文件加载数据（增强版日志）
@@ -224,29 +563,35 @@ class EnhancedAIDocGenerator:
         logger.info("📂 阶段2：开始加载JSON数据...")
         
         try:
-            if not os.path.exists(json_file_path):
-                logger.error(f"❌ JSON文件不存在: {json_file_path}")
-                return {}
-            
-            logger.info(f"📄 正在读取JSON文件: {json_file_path}")
-            
-            with open(json_file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            
-            logger.info(f"✅ 成功加载 {len(data)} 个数据字段:")
-            for key, value in data.items():
-                preview = value[:50] + "..." if len(str(value)) > 50 else str(value)
-                logger.info(f"   📌 {key}: {preview}")
-            
-            # 记录数据字段统计
-            self._log_data_statistics(data)
-            
-            return data
-            
-        except Exception as e:
+            return self._stage2_impl(json_file_path)
+        except (_json.JSONDecodeError, OSError) as e:
             logger.error(f"❌ 阶段2错误: {e}")
             return {}
     
+    def _stage2_impl(self, json_file_path: str) -> Dict[str, str]:
+        """阶段2的具体实现，可恢复的错误由调用方处理"""
+        if not os.path.exists(json_file_path):
+            logger.error(f"❌ JSON文件不存在: {json_file_path}")
+            return {}
+        
+        logger.info(f"📄 正在读取JSON文件: {json_file_path}")
+        
+        with open(json_file_path, 'rb') as f:
+            data = _json.loads(f.read())
+        
+        if not isinstance(data, dict):
+            logger.error(f"❌ JSON顶层必须是对象，实际为: {type(data).__name__}")
+            return {}
+        
+        logger.info(f"✅ 成功加载 {len(data)} 个数据字段")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("📌 数据字段:%s", ''.join(f"\n   📌 {key}: {_preview(value)}" for key, value in data.items()))
+        
+        # 记录数据字段统计
+        self._log_data_statistics(data)
+        
+        return data
+    
     def stage2_5_enhanced_ai_field_mapping(self, template_structure: Dict[str, str], input_data: Dict[str, str]) -> Dict[str, str]:
         """
         阶段2.5：增强版AI智能字段映射
@@ -261,137 +606,154 @@ class EnhancedAIDocGenerator:
         logger.info("🧠 阶段2.5：开始增强版AI字段映射...")
         
         try:
-            # 构建增强版AI映射提示
-            base_prompt = self.prompt_templates.get_field_mapping_prompt(template_structure, input_data)
-            enhanced_prompt = self.prompt_templates.enhance_mapping_prompt_with_examples(base_prompt)
-            
-            logger.info("🧠 正在调用AI进行增强版字段映射...")
-            logger.info(f"📊 模板字段数量: {len(template_structure)}")
-            logger.info(f"📊 输入数据字段数量: {len(input_data)}")
-            
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[{"role": "user", "content": enhanced_prompt}],
-                extra_headers={
-                    "HTTP-Referer": "ai-doc-generator",
-                    "X-Title": "AI Document Generator Enhanced",
-                }
-            )
-            
-            # 解析返回的JSON
-            json_text = self.prompt_helper.extract_json_from_response(response.choices[0].message.content)
-            
-            # 验证JSON有效性
-            if not self.prompt_helper.validate_json_structure(json_text):
-                logger.warning("⚠️ AI映射返回的JSON格式无效，尝试直接映射")
-                mapped_data = self._fallback_field_mapping(template_structure, input_data)
-            else:
-                mapped_data = json.loads(json_text)
-            
-            logger.info(f"✅ 成功映射 {len(mapped_data)} 个字段:")
-            for key, value in mapped_data.items():
-                preview = value[:50] + "..." if len(str(value)) > 50 else str(value)
-                logger.info(f"   🔗 {key}: {preview}")
-            
-            # 详细的映射统计和验证
-            self._log_mapping_statistics(template_structure, input_data, mapped_data)
-            
-            return mapped_data
-            
-        except Exception as e:
+            return self._stage2_5_impl(template_structure, input_data)
+        except (_json.JSONDecodeError, APIError, EmptyAIResponseError, KeyError) as e:
             logger.error(f"❌ 阶段2.5错误: {e}")
             logger.warning("⚠️ AI字段映射失败，使用降级映射策略")
             return self._fallback_field_mapping(template_structure, input_data)
     
-    def stage3_position_aware_template_filling(self, template_path: str, output_path: str, mapped_data: Dict[str, str], template_structure: Dict[str, str]):
+    def _stage2_5_impl(self, template_structure: Dict[str, str], input_data: Dict[str, str]) -> Dict[str, str]:
+        """阶段2.5的具体实现，可恢复的错误由调用方处理"""
+        # 构建增强版AI映射提示
+        base_prompt = self.prompt_templates.get_field_mapping_prompt(template_structure, input_data)
+        enhanced_prompt = self.prompt_templates.enhance_mapping_prompt_with_examples(base_prompt)
+        
+        logger.info("🧠 正在调用AI进行增强版字段映射...")
+        logger.info(f"📊 模板字段数量: {len(template_structure)}")
+        logger.info(f"📊 输入数据字段数量: {len(input_data)}")
+        
+        response_text, from_cache = self._chat_completion(enhanced_prompt)
+        
+        # 解析返回的JSON
+        json_text = self.prompt_helper.extract_json_from_response(response_text)
+        
+        # 验证JSON有效性，顶层必须是对象
+        parsed = _json.loads(json_text) if self.prompt_helper.validate_json_structure(json_text) else None
+        if not isinstance(parsed, dict):
+            logger.warning("⚠️ AI映射返回的JSON格式无效，尝试直接映射")
+            mapped_data = self._fallback_field_mapping(template_structure, input_data)
+        else:
+            mapped_data = parsed
+            if not from_cache:
+                self._cache_chat_reply(enhanced_prompt, response_text)
+        
+        logger.info(f"✅ 成功映射 {len(mapped_data)} 个字段")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("🔗 映射结果:%s", ''.join(f"\n   🔗 {key}: {_preview(value)}" for key, value in mapped_data.items()))
+        
+        # 详细的映射统计和验证
+        self._log_mapping_statistics(template_structure, input_data, mapped_data)
+        
+        return mapped_data
+    
+    def stage3_position_aware_template_filling(self, template: Union[str, DocumentObject], output_path: str, mapped_data: Dict[str, str], template_structure: Dict[str, str]):
         """
         阶段3：位置感知的智能模板填充
         
         Args:
-            template_path: 模板文件路径
+            template: 模板文件路径或已打开的Document对象（将被直接修改）
             output_path: 输出文件路径
             mapped_data: 位置感知映射后的数据
             template_structure: 模板结构（用于验证）
         """
         logger.info("📝 阶段3：开始位置感知的智能模板填充...")
         
-        if not os.path.exists(template_path):
-            logger.error(f"❌ 模板文件未找到: {template_path}")
+        if isinstance(template, (str, os.PathLike)) and not os.path.exists(template):
+            logger.error(f"❌ 模板文件未找到: {template}")
             return False
 
         try:
-            logger.info(f"📄 正在打开模板: {template_path}")
-            doc = Document(template_path)
-
-            if not doc.tables:
-                logger.error("❌ 文档中未找到任何表格")
-                return False
-
-            table = doc.tables[0]
-            filled_fields = []
-            skipped_fields = []
-            position_matches = {}
-
-            logger.info("🔍 开始位置感知的智能搜索和填充...")
-
-            # 构建位置映射表
-            for key in mapped_data.keys():
-                if mapped_data[key]:  # 只处理有值的字段
-                    position_info = self._parse_position_key(key)
-                    if position_info:
-                        position_matches[key] = position_info
-                        logger.info(f"🎯 位置解析: {key} -> Row{position_info['row']}, Col{position_info['col']}, Context: {position_info.get('context', 'N/A')}")
-
-            # 遍历表格进行位置匹配填充
-            for row_idx, row in enumerate(table.rows):
-                for cell_idx, cell in enumerate(row.cells):
-                    cell_text = cell.text.strip()
-                    
-                    # 查找匹配的位置字段
-                    for field_key, field_value in mapped_data.items():
-                        if not field_value:  # 跳过空值
-                            continue
-                            
-                        position_info = position_matches.get(field_key)
-                        if not position_info:
-                            continue
-                        
-                        # 位置匹配逻辑
-                        if self._is_position_match(row_idx, cell_idx, cell_text, position_info, row):
-                            try:
-                                success = self._fill_cell_by_position(cell, row, cell_idx, field_value, position_info)
-                                if success:
-                                    filled_fields.append(f"{field_key} -> {field_value[:50]}{'...' if len(field_value) > 50 else ''}")
-                                    logger.info(f"   ✏️ 位置填充成功: {field_key}")
-                                else:
-                                    skipped_fields.append(f"{field_key}: 填充失败")
-                                    logger.warning(f"   ⚠️ 位置填充失败: {field_key}")
-                            except Exception as e:
-                                skipped_fields.append(f"{field_key}: {str(e)}")
-                                logger.error(f"   ❌ 填充异常: {field_key} - {e}")
-
-            # 保存文档
-            doc.save(output_path)
-            
-            # 详细的填充结果统计
-            logger.info(f"✅ 文档已成功生成: {output_path}")
-            logger.info(f"📊 共填充 {len(filled_fields)} 个字段:")
-            for field in filled_fields:
-                logger.info(f"   ✓ {field}")
-            
-            if skipped_fields:
-                logger.warning(f"⚠️ 跳过 {len(skipped_fields)} 个字段:")
-                for field in skipped_fields:
-                    logger.warning(f"   ⏭️ {field}")
-            
-            # 验证未填充的模板字段
-            self._validate_unfilled_fields(template_structure, filled_fields)
-            
-            return True
-
-        except Exception as e:
+            return self._stage3_impl(template, output_path, mapped_data, template_structure)
+        except (OSError, KeyError, PackageNotFoundError) as e:
             logger.error(f"❌ 阶段3错误: {e}")
             return False
+    
+    def _stage3_impl(self, template: Union[str, DocumentObject], output_path: str, mapped_data: Dict[str, str], template_structure: Dict[str, str]) -> bool:
+        """阶段3的具体实现，可恢复的错误由调用方处理"""
+        if isinstance(template, (str, os.PathLike)):
+            logger.info(f"📄 正在打开模板: {template}")
+        doc = _open_template(template)
+
+        if not doc.tables:
+            logger.error("❌ 文档中未找到任何表格")
+            return False
+
+        table = doc.tables[0]
+        filled_fields = []
+        skipped_fields = []
+        position_matches = {}
+
+        logger.info("🔍 开始位置感知的智能搜索和填充...")
+
+        # 构建位置映射表
+        for key in mapped_data.keys():
+            if mapped_data[key]:  # 只处理有值的字段
+                position_info = self._parse_position_key(key)
+                if position_info:
+                    position_matches[key] = position_info
+                    logger.debug("🎯 位置解析: %s -> Row%s, Col%s, Context: %s",
+                                 key, position_info['row'], position_info['col'], position_info.get('context', 'N/A'))
+
+        # 按目标位置分组：next_cell按(行, 列)，same_cell_with_context按行
+        by_coord: Dict[Tuple[int, int], List[Tuple[str, str, Dict[str, Any]]]] = defaultdict(list)
+        by_row: Dict[int, List[Tuple[str, str, Dict[str, Any]]]] = defaultdict(list)
+        for field_key, position_info in position_matches.items():
+            candidate = (field_key, mapped_data[field_key], position_info)
+            if position_info['fill_type'] == 'same_cell_with_context':
+                by_row[position_info['row']].append(candidate)
+            else:
+                by_coord[(position_info['row'], position_info['col'])].append(candidate)
+
+        # 只访问存在目标字段的行，其余行不进入逐单元格循环
+        rows = table.rows
+        target_rows = sorted({row_idx for row_idx, _ in by_coord} | set(by_row))
+        
+        # 位置匹配填充，每个单元格只检查目标位于此处的字段
+        for row_idx in target_rows:
+            if not 0 <= row_idx < len(rows):
+                continue
+            # 每行只展开一次单元格并缓存文本，后续按索引访问
+            row_cells = list(rows[row_idx].cells)
+            row_texts = [cell.text.strip() for cell in row_cells]
+            row_candidates = by_row.get(row_idx, [])
+            for cell_idx, cell in enumerate(row_cells):
+                candidates = by_coord.get((row_idx, cell_idx), []) + row_candidates
+                if not candidates:
+                    continue
+                
+                cell_text = row_texts[cell_idx]
+                
+                # 查找匹配的位置字段
+                for field_key, field_value, position_info in candidates:
+                    # 位置匹配逻辑
+                    if self._is_position_match(row_idx, cell_idx, cell_text, position_info, row_texts):
+                        try:
+                            success = self._fill_cell_by_position(cell, row_cells, cell_idx, field_value, position_info)
+                            if success:
+                                filled_fields.append(f"{field_key} -> {field_value[:50]}{'...' if len(field_value) > 50 else ''}")
+                                logger.debug("   ✏️ 位置填充成功: %s", field_key)
+                            else:
+                                skipped_fields.append(f"{field_key}: 填充失败")
+                                logger.warning(f"   ⚠️ 位置填充失败: {field_key}")
+                        except Exception as e:
+                            skipped_fields.append(f"{field_key}: {str(e)}")
+                            logger.error(f"   ❌ 填充异常: {field_key} - {e}")
+
+        # 保存文档
+        doc.save(output_path)
+        
+        # 详细的填充结果统计
+        logger.info(f"✅ 文档已成功生成: {output_path}")
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("📊 共填充 %d 个字段:%s", len(filled_fields), ''.join(f"\n   ✓ {field}" for field in filled_fields))
+        
+        if skipped_fields:
+            logger.warning("⚠️ 跳过 %d 个字段:%s", len(skipped_fields), ''.join(f"\n   ⏭️ {field}" for field in skipped_fields))
+        
+        # 验证未填充的模板字段
+        self._validate_unfilled_fields(template_structure, filled_fields)
+        
+        return True
 
     def _parse_position_key(self, position_key: str) -> Dict[str, Any]:
         """
@@ -403,39 +765,10 @@ class EnhancedAIDocGenerator:
         Returns:
             解析后的位置信息字典
         """
-        try:
-            parts = position_key.split('_')
-            if len(parts) < 4:
-                return None
-            
-            row = int(parts[1]) - 1  # 转换为0索引
-            
-            # 处理不同的位置格式
-            if parts[2] == "col":
-                col = int(parts[3]) - 1  # 转换为0索引
-                field_name = '_'.join(parts[4:])
-                return {
-                    'row': row,
-                    'col': col,
-                    'field_name': field_name,
-                    'fill_type': 'next_cell'
-                }
-            elif parts[2] == "left":
-                context = parts[3]
-                field_name = '_'.join(parts[4:])
-                return {
-                    'row': row,
-                    'col': -1,  # 表示需要根据上下文查找
-                    'context': context,
-                    'field_name': field_name,
-                    'fill_type': 'same_cell_with_context'
-                }
-            
-            return None
-        except (ValueError, IndexError):
-            return None
+        position_info = _parse_position_key_cached(position_key)
+        return dict(position_info) if position_info else None
 
-    def _is_position_match(self, row_idx: int, cell_idx: int, cell_text: str, position_info: Dict[str, Any], row) -> bool:
+    def _is_position_match(self, row_idx: int, cell_idx: int, cell_text: str, position_info: Dict[str, Any], row_texts: List[str]) -> bool:
         """
         判断当前位置是否匹配目标填充字段
         
@@ -444,7 +777,7 @@ class EnhancedAIDocGenerator:
             cell_idx: 当前列索引
             cell_text: 当前单元格文本
             position_info: 位置信息
-            row: 当前行对象
+            row_texts: 当前行各单元格的文本
             
         Returns:
             是否匹配
@@ -460,18 +793,17 @@ class EnhancedAIDocGenerator:
             if row_idx == position_info['row'] and position_info['field_name'] in cell_text:
                 # 检查左侧单元格是否包含上下文
                 if cell_idx > 0:
-                    left_cell_text = row.cells[cell_idx-1].text
-                    return position_info['context'] in left_cell_text
+                    return position_info['context'] in row_texts[cell_idx-1]
                     
         return False
 
-    def _fill_cell_by_position(self, cell, row, cell_idx: int, field_value: str, position_info: Dict[str, Any]) -> bool:
+    def _fill_cell_by_position(self, cell, row_cells: List, cell_idx: int, field_value: str, position_info: Dict[str, Any]) -> bool:
         """
         根据位置信息填充单元格
         
         Args:
             cell: 当前单元格对象
-            row: 当前行对象
+            row_cells: 当前行的单元格列表
             cell_idx: 单元格索引
             field_value: 要填充的值
             position_info: 位置信息
@@ -482,13 +814,13 @@ class EnhancedAIDocGenerator:
         try:
             if position_info['fill_type'] == 'next_cell':
                 # 填充下一个单元格
-                if cell_idx + 1 < len(row.cells):
-                    row.cells[cell_idx + 1].text = field_value
+                if cell_idx + 1 < len(row_cells):
+                    _set_cell_text(row_cells[cell_idx + 1], field_value)
                     return True
             
             elif position_info['fill_type'] == 'same_cell_with_context':
                 # 在同一单元格中添加内容
-                cell.add_paragraph(field_value)
+                _append_cell_paragraph(cell, field_value)
                 return True
                 
         except Exception as e:
@@ -504,50 +836,34 @@ class EnhancedAIDocGenerator:
         
         mapped_data = {}
         
-        # 基础映射规则
-        mapping_rules = {
-            "serial_number": ["编号", "number", "id"],
-            "project_name": ["项目名称", "name", "title"],  
-            "review_date": ["复核日期", "date", "check_date"],
-            "original_condition_review": ["原形制", "original_state", "original_form"],
-            "damage_assessment_review": ["病害和残损", "damage", "deterioration"],
-            "repair_plan_review": ["修缮做法", "repair_method", "repair_plan"],
-            "project_lead": ["项目负责人", "project_manager", "manager", "lead"],
-            "reviewer": ["复核人员", "reviewers", "checker"]
-        }
-        
         # 反向映射：从输入数据字段到模板字段
         for template_key in template_structure.keys():
+            # 一次扫描确定模板字段所属的语义类别
+            template_semantics = {
+                semantic_key for token, semantic_key in self._rule_inverted_index.items()
+                if token in template_key
+            }
+            
             for input_key, input_value in input_data.items():
-                if input_value:  # 只处理有值的字段
-                    # 直接匹配
-                    if input_key in template_key or any(rule in template_key for rule_list in mapping_rules.values() for rule in rule_list):
-                        mapped_data[template_key] = input_value
-                        break
-                    
-                    # 语义匹配
-                    for semantic_key, possible_names in mapping_rules.items():
-                        if input_key in possible_names or input_key == semantic_key:
-                            if any(name in template_key for name in possible_names):
-                                mapped_data[template_key] = input_value
-                                break
+                if not input_value:  # 只处理有值的字段
+                    continue
+                
+                # 直接匹配或语义匹配
+                if input_key in template_key or self._rule_inverted_index.get(input_key) in template_semantics:
+                    mapped_data[template_key] = input_value
+                    break
         
         logger.info(f"🔄 降级映射完成，映射了 {len(mapped_data)} 个字段")
         return mapped_data
 
     def _log_field_statistics(self, template_structure: Dict[str, str]):
         """记录字段统计信息"""
-        field_types = {'basic_info': 0, 'review_situation': 0, 'personnel': 0, 'other': 0}
-        
+        counts = Counter()
         for key in template_structure.keys():
-            if any(info in key for info in ['编号', '项目名称', '复核日期']):
-                field_types['basic_info'] += 1
-            elif '现场复核情况' in key:
-                field_types['review_situation'] += 1
-            elif any(person in key for person in ['负责人', '复核人员']):
-                field_types['personnel'] += 1
-            else:
-                field_types['other'] += 1
+            m = _FIELD_CLASSIFIER.search(key)
+            counts[_FIELD_TYPES[m.lastindex] if m else 'other'] += 1
+        
+        field_types = {field_type: counts[field_type] for field_type in ('basic_info', 'review_situation', 'personnel', 'other')}
         
         logger.info(f"📊 字段类型统计: {field_types}")
 
@@ -574,8 +890,9 @@ class EnhancedAIDocGenerator:
             logger.warning(f"⚠️ 未映射的模板字段 ({len(unmapped_template)}): {unmapped_template}")
         
         # 检查未使用的输入字段
-        used_input_values = set(mapped_data.values())
-        unused_input = [key for key, value in input_data.items() if value and value not in used_input_values]
+        # 值可能是列表或字典（不可哈希），统一按字符串比较
+        used_input_values = {str(value) for value in mapped_data.values()}
+        unused_input = [key for key, value in input_data.items() if value and str(value) not in used_input_values]
         if unused_input:
             logger.warning(f"⚠️ 未使用的输入字段 ({len(unused_input)}): {unused_input}")
 
@@ -585,13 +902,18 @@ class EnhancedAIDocGenerator:
         unfilled_keys = [key for key in template_structure.keys() if key not in filled_field_keys]
         
         if unfilled_keys:
-            logger.warning(f"⚠️ 模板中有 {len(unfilled_keys)} 个字段未被填充:")
-            for key in unfilled_keys:
-                logger.warning(f"   🔍 未填充: {key}")
+            logger.warning("⚠️ 模板中有 %d 个字段未被填充:%s", len(unfilled_keys), ''.join(f"\n   🔍 未填充: {key}" for key in unfilled_keys))
 
-    def run_enhanced_workflow(self, doc_template_path: str, json_input_path: str, output_path: str):
+    def run_enhanced_workflow(self, doc_template_path: str, json_input_path: str, output_path: str,
+                              docx_template_path: Optional[str] = None):
         """
         运行增强版的完整工作流程
+        
+        Args:
+            doc_template_path: DOC模板文件路径
+            json_input_path: JSON输入文件路径
+            output_path: 输出文件路径
+            docx_template_path: 已转换的DOCX模板路径，提供时跳过阶段0
         """
         logger.info("🚀 开始增强版AI文档生成流程")
         logger.info("=" * 60)
@@ -600,15 +922,23 @@ class EnhancedAIDocGenerator:
         
         try:
             # 阶段0：DOC转DOCX转换
-            docx_template_path = self.convert_doc_to_docx(doc_template_path)
+            if docx_template_path is None:
+                docx_template_path = self.convert_doc_to_docx(doc_template_path)
             logger.info("=" * 30)
             
-            # 阶段1：位置感知的模板分析
-            template_structure = self.stage1_analyze_template_with_position(docx_template_path)
-            logger.info("=" * 30)
+            # 模板只解析一次，阶段1读取、阶段3直接在其上填充
+            logger.info(f"📄 正在读取模板文件: {docx_template_path}")
+            template_doc = Document(docx_template_path)
             
-            # 阶段2：加载JSON数据
-            input_data = self.stage2_load_json_data(json_input_path)
+            # 阶段1与阶段2互不依赖：AI分析在后台线程进行，同时在主线程加载JSON数据
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                # 阶段1：位置感知的模板分析
+                stage1_future = executor.submit(self.stage1_analyze_template_with_position, template_doc)
+                
+                # 阶段2：加载JSON数据
+                input_data = self.stage2_load_json_data(json_input_path)
+                
+                template_structure = stage1_future.result()
             logger.info("=" * 30)
             
             # 阶段2.5：增强版AI字段映射
@@ -616,7 +946,7 @@ class EnhancedAIDocGenerator:
             logger.info("=" * 30)
             
             # 阶段3：位置感知的模板填充
-            success = self.stage3_position_aware_template_filling(docx_template_path, output_path, mapped_data, template_structure)
+            success = self.stage3_position_aware_template_filling(template_doc, output_path, mapped_data, template_structure)
             
             end_time = datetime.now()
             duration = (end_time - start_time).total_seconds()
@@ -636,15 +966,45 @@ class EnhancedAIDocGenerator:
             logger.error(f"❌ 增强版工作流程失败: {e}")
             return False
 
+    def run_enhanced_batch_workflow(self, jobs: List[Tuple[str, str, str]]) -> List[bool]:
+        """
+        批量运行工作流程：先并行完成所有DOC转换，再逐个执行AI阶段
+        
+        Args:
+            jobs: (DOC模板路径, JSON输入路径, 输出路径) 列表
+            
+        Returns:
+            每个任务是否成功
+        """
+        docx_template_paths = self.convert_many([doc_template_path for doc_template_path, _, _ in jobs])
+        
+        results = []
+        for (doc_template_path, json_input_path, output_path), docx_template_path in zip(jobs, docx_template_paths):
+            if docx_template_path is None:
+                logger.error(f"❌ 跳过转换失败的模板: {doc_template_path}")
+                results.append(False)
+                continue
+            results.append(self.run_enhanced_workflow(
+                doc_template_path=doc_template_path,
+                json_input_path=json_input_path,
+                output_path=output_path,
+                docx_template_path=docx_template_path
+            ))
+        
+        return results
+
+
+@functools.cache
+def get_generator() -> EnhancedAIDocGenerator:
+    """获取进程内共享的生成器，API Key从 OPENROUTER_API_KEY 环境变量读取"""
+    return EnhancedAIDocGenerator(os.environ["OPENROUTER_API_KEY"])
+
 
 def main():
     """主函数"""
     print("🚀 增强版AI文档生成器 - 主程序")
     print("=" * 50)
     
-    # 配置
-    API_KEY = "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"
-    
     # 文件路径
     doc_template_path = "template_test.doc"
     json_input_path = "sample_input.json"
@@ -661,7 +1021,10 @@ def main():
     
     # 初始化增强版生成器
     try:
-        generator = EnhancedAIDocGenerator(API_KEY)
+        generator = get_generator()
+    except KeyError:
+        logger.error("❌ 未设置 OPENROUTER_API_KEY 环境变量")
+        return
     except Exception as e:
         logger.error(f"❌ 增强版生成器初始化失败: {e}")
         return